@@ -1,15 +1,35 @@
 # Import required libraries
-from sentence_transformers import SentenceTransformer
+from encoders import EMBEDDING_MODEL, load_encoder, OnnxEncoder
 from couchbase.auth import PasswordAuthenticator
 from couchbase.cluster import Cluster
-from couchbase.options import ClusterOptions, ClusterTimeoutOptions
+from couchbase.options import ClusterOptions, ClusterTimeoutOptions, QueryOptions
+from couchbase.n1ql import QueryScanConsistency
+from serializers import ORJSON_AVAILABLE, json_transcoder
+import numpy as np
+import torch
+import torch.nn.functional as F
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import base64
 import json
 import uuid
 import os
 import sys
 
-# Load the sentence transformer model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Embed on the GPU when one is available; this is a one-shot bulk job
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+# Set USE_BF16=true to run the PyTorch model in bfloat16 on CPUs with AMX/AVX-512 BF16
+USE_BF16 = DEVICE == 'cpu' and os.getenv("USE_BF16", "false").lower() == "true"
+
+# Load the sentence transformer model (quantized ONNX version when available on CPU)
+model = load_encoder(EMBEDDING_MODEL, device=DEVICE)
+
+# Cap the sequence length; attention cost grows with the square of the padded length.
+# The token length distribution is reported at the end of the run so the cap can be tuned.
+MAX_SEQ_LENGTH = int(os.getenv("MAX_SEQ_LENGTH", "128"))
+model.max_seq_length = MAX_SEQ_LENGTH
 
 # Couchbase Capella connection parameters
 # Update these with your actual Capella connection details
@@ -21,6 +41,18 @@ CB_SCOPE = "inventory"
 CB_COLLECTION_SOURCE = "hotel"
 CB_COLLECTION_TARGET = "reviewvector"
 
+# How embeddings are stored in the vector documents:
+#   "float"  - JSON array of floats (index the field as type "vector")
+#   "base64" - base64 of little-endian float32 bytes (index the field as type
+#              "vector_base64"); roughly a quarter of the JSON size
+#   "int8"   - JSON array of int8 values scaled by the largest component, with the
+#              scale kept in "embedding_scale"; the index must use cosine similarity
+EMBEDDING_FORMAT = os.getenv("EMBEDDING_FORMAT", "float").lower()
+
+# Directory for the local copy of the review vectors (embeddings.f32 + ids.txt);
+# set VECTOR_EXPORT_DIR to an empty string to skip the export
+VECTOR_EXPORT_DIR = os.getenv("VECTOR_EXPORT_DIR", "vector_export")
+
 # Path to the Capella certificate file
 # Download this from your Capella dashboard
 CERT_PATH = "/Users/sandhya.krishnamurthy/Downloads/AIchatbot/AIDEMOCLUSTER-root-certificate.pem"
@@ -48,8 +80,8 @@ try:
         query_timeout=timedelta(seconds=75)
     )
     
-    # Create cluster options with certificate path
-    options = ClusterOptions(authenticator=auth, timeout_options=timeout_opts)
+    # Create cluster options with certificate path; documents are encoded with orjson when available
+    options = ClusterOptions(authenticator=auth, timeout_options=timeout_opts, transcoder=json_transcoder())
     
     # Set certificate path for TLS/SSL connections
     options.ssl_cert = CERT_PATH
@@ -97,70 +129,307 @@ query = f"""
 
 # Function to extract reviews from a hotel document
 def extract_reviews(hotel_doc):
-    reviews = []
-    if 'reviews' in hotel_doc and isinstance(hotel_doc['reviews'], list):
-        for review in hotel_doc['reviews']:
-            if 'content' in review:
-                reviews.append({
-                    'hotel_id': hotel_doc.get('doc_id'),
-                    'hotel_name': hotel_doc.get('name', 'Unknown Hotel'),
-                    'review_author': review.get('author', 'Anonymous'),
-                    'review_date': review.get('date', ''),
-                    'review_content': review['content'],
-                    'review_ratings': review.get('ratings', {})
-                })
-    return reviews
+    # Hotel-level fields are the same for every review, so look them up once
+    reviews = hotel_doc.get('reviews')
+    hotel_id = hotel_doc.get('doc_id')
+    hotel_name = hotel_doc.get('name', 'Unknown Hotel')
+    return [
+        {
+            'hotel_id': hotel_id,
+            'hotel_name': hotel_name,
+            'review_author': review.get('author', 'Anonymous'),
+            'review_date': review.get('date', ''),
+            'review_content': review['content'],
+            'review_ratings': review.get('ratings', {})
+        }
+        for review in (reviews or [])
+        if isinstance(review, dict) and 'content' in review
+    ]
 
 # Execute the query
 print("Retrieving hotel documents...")
 try:
-    result = cluster.query(query)
+    # The scan does not need read-your-own-writes, so skip waiting for index
+    # consistency; let the query service scan in parallel and reuse a prepared plan
+    result = cluster.query(query, QueryOptions(
+        scan_consistency=QueryScanConsistency.NOT_BOUNDED,
+        max_parallelism=8,
+        adhoc=False
+    ))
 except Exception as e:
     print(f"Query error: {e}")
     sys.exit(1)
 
-# Process each hotel document
-processed_count = 0
-review_count = 0
+# Number of reviews to embed per encode call
+ENCODE_CHUNK_SIZE = 4096
+ENCODE_BATCH_SIZE = 128 if DEVICE == 'cuda' else 64
+# Number of vector documents written per upsert_multi call
+UPSERT_BATCH_SIZE = 200
 
-for hotel in result:
-    # Extract hotel document
-    hotel_doc = hotel
+# The ingestion runs as a three-stage pipeline so that fetching hotels,
+# embedding reviews and writing vectors overlap instead of waiting on each other:
+#   fetch_hotels -> q_reviews -> encode_reviews -> q_out -> upsert_vectors
+# Each stage puts SENTINEL on its output queue when it has no more work.
+# stop_event is set when storing fails, so the upstream stages stop producing work.
+SENTINEL = None
+q_reviews = queue.Queue(maxsize=1000)
+q_out = queue.Queue(maxsize=ENCODE_CHUNK_SIZE * 2)
+stop_event = threading.Event()
 
-    # Extract reviews from the hotel document
-    reviews = extract_reviews(hotel_doc)
-    
-    # Process each review
-    for review in reviews:
+# Stage A: stream hotel documents from the query and queue their reviews
+def fetch_hotels():
+    processed = 0
+    try:
+        for hotel in result:
+            if stop_event.is_set():
+                break
+            q_reviews.put(extract_reviews(hotel))
+            processed += 1
+            if processed % 10 == 0:
+                print(f"Fetched {processed} hotels")
+    except Exception as e:
+        print(f"Error fetching hotel documents: {e}")
+    finally:
+        q_reviews.put(SENTINEL)
+    return processed
+
+# Function to convert an embedding into the document fields for the configured storage format
+def embedding_fields(embedding):
+    if EMBEDDING_FORMAT == "base64":
+        return {'embedding': base64.b64encode(embedding.astype('<f4').tobytes()).decode('ascii')}
+
+    if EMBEDDING_FORMAT == "int8":
+        # Per-document scaling changes the vector's length but not its direction,
+        # so cosine similarity against float query vectors is preserved
+        max_abs = float(np.abs(embedding).max()) or 1.0
+        quantized = np.round(embedding * (127 / max_abs)).astype(np.int8)
+        return {
+            'embedding': quantized if ORJSON_AVAILABLE else quantized.tolist(),
+            'embedding_scale': max_abs / 127
+        }
+
+    if ORJSON_AVAILABLE:
+        # The orjson transcoder writes float32 arrays directly, skipping the
+        # boxing of 384 Python floats and emitting shorter float32 reprs
+        return {'embedding': np.ascontiguousarray(embedding, dtype=np.float32)}
+    return {'embedding': embedding.tolist()}
+
+# Untruncated token length of every review embedded so far, one array per chunk
+token_lengths = []
+
+# Function to pad the token ids of each mini-batch, taking the texts in the given order
+def padded_batches(encoded, order, return_tensors):
+    for start in range(0, len(order), ENCODE_BATCH_SIZE):
+        batch_idx = order[start:start + ENCODE_BATCH_SIZE]
+        features = model.tokenizer.pad(
+            {key: [values[i] for i in batch_idx] for key, values in encoded.items()},
+            padding=True,
+            return_tensors=return_tensors
+        )
+        yield batch_idx, features
+
+# Function to embed texts in length-sorted mini-batches.
+# Texts are tokenized once with the fast tokenizer. The token lengths drive the
+# sort so each mini-batch pads to a similar length, and the same token ids are
+# padded per batch and fed straight to the model (ONNX session or transformer),
+# skipping the second tokenization pass in encode().
+def encode_texts(texts):
+    # Tokenize untruncated so the real lengths can be recorded, then cut each
+    # sequence down to MAX_SEQ_LENGTH while keeping its final [SEP] token
+    encoded = model.tokenizer(texts)
+    lengths = np.array([len(ids) for ids in encoded['input_ids']])
+    token_lengths.append(lengths)
+    encoded = {
+        key: [ids if len(ids) <= MAX_SEQ_LENGTH else ids[:MAX_SEQ_LENGTH - 1] + ids[-1:] for ids in values]
+        for key, values in encoded.items()
+    }
+    order = np.argsort(np.minimum(lengths, MAX_SEQ_LENGTH), kind='stable')
+
+    if isinstance(model, OnnxEncoder):
+        embeddings = None
+        for batch_idx, features in padded_batches(encoded, order, 'np'):
+            batch_embeddings = model.encode_features(features)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch_idx] = batch_embeddings
+        return embeddings
+
+    transformer = model.auto_model
+    embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    with torch.inference_mode(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=USE_BF16):
+        for batch_idx, features in padded_batches(encoded, order, 'pt'):
+            features = features.to(DEVICE)
+            token_embeddings = transformer(**features).last_hidden_state
+
+            # Mean-pool over real tokens and L2-normalize, matching the sentence-transformers models
+            mask = features['attention_mask'].unsqueeze(-1).to(token_embeddings.dtype)
+            pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            embeddings[batch_idx] = F.normalize(pooled, p=2, dim=1).float().cpu().numpy()
+    return embeddings
+
+# Embed a chunk of reviews and queue the resulting vector documents
+def embed_chunk(pending):
+    embeddings = encode_texts([review['review_content'] for review in pending])
+
+    for review, embedding in zip(pending, embeddings):
+        # Create document to store in the target collection
+        vector_doc = {
+            'hotel_id': review['hotel_id'],
+            'hotel_name': review['hotel_name'],
+            'review_author': review['review_author'],
+            'review_date': review['review_date'],
+            'review_content': review['review_content'],
+            'review_ratings': review['review_ratings'],
+            **embedding_fields(embedding)
+        }
+        
+        # Generate a unique ID for the review vector document
+        doc_id = f"review_vector_{str(uuid.uuid4())}"
+        q_out.put((doc_id, vector_doc, embedding))
+
+# Stage B: collect reviews into chunks and embed each chunk
+def encode_reviews():
+    pending = []
+    try:
+        while True:
+            reviews = q_reviews.get()
+            if reviews is SENTINEL:
+                break
+            # Keep draining (so fetch_hotels never blocks) but embed nothing more
+            if stop_event.is_set():
+                pending = []
+                continue
+            pending.extend(reviews)
+            if len(pending) >= ENCODE_CHUNK_SIZE:
+                try:
+                    embed_chunk(pending)
+                except Exception as e:
+                    print(f"Error embedding {len(pending)} reviews: {e}")
+                pending = []
+
+        # Flush the final partial chunk
+        if pending and not stop_event.is_set():
+            try:
+                embed_chunk(pending)
+            except Exception as e:
+                print(f"Error embedding {len(pending)} reviews: {e}")
+    finally:
+        q_out.put(SENTINEL)
+
+# Write a batch of vector documents in a single pipelined call and
+# return the IDs of the documents that could not be stored
+def flush_upserts(batch):
+    try:
+        multi_result = target_collection.upsert_multi(batch)
+    except Exception as e:
+        print(f"Error upserting {len(batch)} review vectors: {e}")
+        return set(batch)
+
+    if multi_result.all_ok:
+        return set()
+
+    # Report the individual documents that failed
+    for doc_id, ex in multi_result.exceptions.items():
+        print(f"Error upserting {doc_id}: {ex}")
+    return set(multi_result.exceptions)
+
+# Append the embeddings of stored documents to the local vector export
+def export_vectors(batch_embeddings, failed):
+    if vectors_file is None:
+        return
+    for doc_id, embedding in batch_embeddings.items():
+        if doc_id not in failed:
+            vectors_file.write(np.asarray(embedding, dtype='<f4').tobytes())
+            ids_file.write(f"{doc_id}\n")
+
+# Stage C: group vector documents and write them to the target collection.
+# This stage is the only consumer of q_out, so after an unexpected error it sets
+# stop_event, keeps draining the queue until the sentinel (otherwise the upstream
+# stages would block on a full queue forever) and re-raises the error once the
+# pipeline has stopped.
+def upsert_vectors():
+    stored = 0
+    batch = {}
+    batch_embeddings = {}
+    error = None
+    while True:
+        item = q_out.get()
+        if item is SENTINEL:
+            break
+        if error is not None:
+            continue
         try:
-            # Generate embedding for the review content
-            review_text = review['review_content']
-            embedding = model.encode(review_text).tolist()
-            
-            # Create document to store in the target collection
-            vector_doc = {
-                'hotel_id': review['hotel_id'],
-                'hotel_name': review['hotel_name'],
-                'review_author': review['review_author'],
-                'review_date': review['review_date'],
-                'review_content': review_text,
-                'review_ratings': review['review_ratings'],
-                'embedding': embedding
-            }
-            
-            # Generate a unique ID for the review vector document
-            doc_id = f"review_vector_{str(uuid.uuid4())}"
-            
-            # Insert the document into the target collection
-            target_collection.upsert(doc_id, vector_doc)
-            review_count += 1
+            doc_id, vector_doc, embedding = item
+            batch[doc_id] = vector_doc
+            batch_embeddings[doc_id] = embedding
+            if len(batch) >= UPSERT_BATCH_SIZE:
+                failed = flush_upserts(batch)
+                export_vectors(batch_embeddings, failed)
+                stored += len(batch) - len(failed)
+                batch = {}
+                batch_embeddings = {}
+                print(f"Stored {stored} reviews")
         except Exception as e:
-            print(f"Error processing review: {e}")
-            continue
-    
-    processed_count += 1
-    if processed_count % 10 == 0:
-        print(f"Processed {processed_count} hotels, {review_count} reviews")
+            print(f"Error storing review vectors, discarding the remaining reviews: {e}")
+            error = e
+            stop_event.set()
+
+    if error is not None:
+        raise error
+
+    if batch:
+        failed = flush_upserts(batch)
+        export_vectors(batch_embeddings, failed)
+        stored += len(batch) - len(failed)
+    return stored
+
+# Open the local vector export: one little-endian float32 row per stored review in
+# embeddings.f32, with the matching document IDs line by line in ids.txt. It can be
+# memory-mapped with np.memmap for local similarity search without parsing JSON.
+# Both files are written under a .tmp name and only replace the previous export once
+# the whole run has succeeded; truncating a file that a running chatbot has
+# memory-mapped would crash it.
+vectors_file = ids_file = None
+if VECTOR_EXPORT_DIR:
+    os.makedirs(VECTOR_EXPORT_DIR, exist_ok=True)
+    vectors_path = os.path.join(VECTOR_EXPORT_DIR, "embeddings.f32")
+    ids_path = os.path.join(VECTOR_EXPORT_DIR, "ids.txt")
+    vectors_file = open(vectors_path + ".tmp", "wb")
+    ids_file = open(ids_path + ".tmp", "w")
+
+# Run the three stages concurrently and wait for them to drain
+export_complete = False
+try:
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        fetch_future = executor.submit(fetch_hotels)
+        encode_future = executor.submit(encode_reviews)
+        upsert_future = executor.submit(upsert_vectors)
+        processed_count = fetch_future.result()
+        encode_future.result()
+        review_count = upsert_future.result()
+    export_complete = True
+finally:
+    if vectors_file is not None:
+        vectors_file.close()
+        ids_file.close()
+        if export_complete:
+            os.replace(vectors_path + ".tmp", vectors_path)
+            os.replace(ids_path + ".tmp", ids_path)
+        else:
+            os.remove(vectors_path + ".tmp")
+            os.remove(ids_path + ".tmp")
+
+if vectors_file is not None:
+    print(f"Review vectors exported to {VECTOR_EXPORT_DIR}")
 
 print(f"Finished processing {processed_count} hotels and {review_count} reviews")
+
+# Report how well MAX_SEQ_LENGTH fits the reviews
+if token_lengths:
+    all_lengths = np.concatenate(token_lengths)
+    p99 = int(np.percentile(all_lengths, 99))
+    suggested = 1 << max(p99 - 1, 1).bit_length()
+    truncated = int((all_lengths > MAX_SEQ_LENGTH).sum())
+    print(f"Token lengths: p99={p99}, suggested MAX_SEQ_LENGTH={suggested}")
+    print(f"{truncated} of {len(all_lengths)} reviews were truncated to {MAX_SEQ_LENGTH} tokens")
 print("All review vectors have been stored in the reviewvector collection")
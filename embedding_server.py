@@ -0,0 +1,99 @@
+# Embedding server: keeps the sentence transformer loaded in one long-lived process
+# so CLI sessions don't pay the model load on every start.
+#
+# Run with:  uvicorn embedding_server:app --port 8000
+# Then start the chatbot with EMBEDDING_SERVER_URL=http://localhost:8000
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from encoders import EMBEDDING_MODEL, load_encoder
+
+# Largest batch sent to the model, and how long to wait for more requests to join one
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "32"))
+BATCH_WINDOW_SECONDS = float(os.getenv("BATCH_WINDOW_MS", "10")) / 1000
+
+# Load the model once for the lifetime of the server
+model = load_encoder(EMBEDDING_MODEL)
+model.max_seq_length = int(os.getenv("MAX_SEQ_LENGTH", "128"))
+
+
+# Function to encode several texts in one model call
+def encode_batch(texts):
+    return model.encode(texts, batch_size=BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+
+
+# Coalesces concurrent requests into batched model calls. The first pending text
+# starts a short window; anything arriving before it closes (up to BATCH_SIZE texts)
+# is encoded together. Every request goes through this one worker thread, so the
+# tokenizer and model are never driven from two threads at once.
+class MicroBatcher:
+    def __init__(self, encode_fn, max_batch_size=BATCH_SIZE, max_wait=BATCH_WINDOW_SECONDS):
+        self._encode_fn = encode_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._pending = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # Encode one text, waiting for the batch it joins to finish
+    def encode(self, text):
+        return self.encode_many([text])[0]
+
+    # Encode several texts, waiting for the batches they join to finish
+    def encode_many(self, texts):
+        futures = []
+        for text in texts:
+            future = Future()
+            self._pending.put((text, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            items = [self._pending.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(items) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                embeddings = self._encode_fn([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(items, embeddings):
+                future.set_result(embedding)
+
+
+batcher = MicroBatcher(encode_batch)
+app = FastAPI()
+
+
+class EncodeRequest(BaseModel):
+    text: str
+
+
+class EncodeBatchRequest(BaseModel):
+    texts: List[str]
+
+
+@app.post("/encode")
+def encode(request: EncodeRequest):
+    return {"embedding": batcher.encode(request.text).tolist()}
+
+
+@app.post("/encode_batch")
+def encode_many(request: EncodeBatchRequest):
+    return {"embeddings": [embedding.tolist() for embedding in batcher.encode_many(request.texts)]}
@@ -0,0 +1,225 @@
+# Embedding model loaders shared by the ingestion script and the chatbot
+#
+# By default the sentence transformer is exported once to ONNX, graph-optimized
+# and dynamically quantized to INT8 (or converted to FP16 with ONNX_PRECISION=fp16),
+# then run through ONNX Runtime. If the optional ONNX dependencies are missing
+# (or USE_ONNX=false), or a GPU device is requested, the PyTorch model is loaded
+# straight through transformers instead.
+import os
+
+import numpy as np
+
+# Embedding model used for both ingestion and queries. Documents and questions must
+# be embedded by the same model, so change this on both sides together (for example
+# EMBEDDING_MODEL=paraphrase-MiniLM-L3-v2 for roughly 2x faster ingestion, after
+# checking retrieval quality and re-embedding every review).
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Set USE_ONNX=false to always use the PyTorch model
+USE_ONNX = os.getenv("USE_ONNX", "true").lower() == "true"
+
+# Directory where exported/quantized ONNX models are cached between runs
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_models"))
+
+# Weight precision of the exported ONNX model: "int8" (dynamic quantization) or "fp16"
+ONNX_PRECISION = os.getenv("ONNX_PRECISION", "int8").lower()
+ONNX_MODEL_FILES = {
+    "int8": "model_optimized_quantized.onnx",
+    "fp16": "model_optimized_fp16.onnx",
+}
+
+
+# Function to get the Hugging Face Hub id for a model name (bare names are sentence-transformers models)
+def hub_model_id(model_name):
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+# Sentence encoder built directly from the transformers tokenizer and model. It applies
+# the same mean pooling and L2 normalization as the sentence-transformers pipeline but
+# skips importing sentence_transformers and its hub/trainer setup.
+class TransformerEncoder:
+    def __init__(self, model_name, device=None, max_seq_length=256, normalize=True):
+        from transformers import AutoModel, AutoTokenizer
+
+        hub_id = hub_model_id(model_name)
+        self.device = device or "cpu"
+        self.tokenizer = AutoTokenizer.from_pretrained(hub_id)
+        self.auto_model = AutoModel.from_pretrained(hub_id).to(self.device).eval()
+        if self.device == "cuda":
+            self.auto_model.half()
+        self.max_seq_length = max_seq_length
+        self.normalize = normalize
+
+    def get_sentence_embedding_dimension(self):
+        return self.auto_model.config.hidden_size
+
+    # Encode one sentence or a list of sentences; mirrors SentenceTransformer.encode
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        import torch
+        import torch.nn.functional as F
+
+        single_input = isinstance(sentences, str)
+        if single_input:
+            sentences = [sentences]
+
+        batches = []
+        with torch.inference_mode():
+            for start in range(0, len(sentences), batch_size):
+                features = self.tokenizer(
+                    sentences[start:start + batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_seq_length,
+                    return_tensors="pt",
+                ).to(self.device)
+                token_embeddings = self.auto_model(**features).last_hidden_state
+
+                # Mean-pool the token embeddings, ignoring padding
+                mask = features["attention_mask"].unsqueeze(-1).to(token_embeddings.dtype)
+                pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                if self.normalize:
+                    pooled = F.normalize(pooled, p=2, dim=1)
+                batches.append(pooled.float().cpu().numpy())
+
+        embeddings = np.vstack(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single_input else embeddings
+
+
+# Sentence encoder backed by an ONNX Runtime inference session
+class OnnxEncoder:
+    def __init__(self, model_dir, file_name, max_seq_length=256, normalize=True):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = max_seq_length
+        self.normalize = normalize
+
+        # Layer fusion is already baked into the optimized graph; enable the
+        # remaining runtime-level optimizations as well
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, file_name), session_options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    # Encode one sentence or a list of sentences; mirrors SentenceTransformer.encode
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        single_input = isinstance(sentences, str)
+        if single_input:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encoded = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding="longest",
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            batches.append(self.encode_features(encoded))
+
+        embeddings = np.vstack(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single_input else embeddings
+
+    # Embed one already tokenized and padded batch (numpy arrays keyed like the tokenizer output)
+    def encode_features(self, features):
+        feeds = {name: features[name].astype(np.int64) for name in self._input_names if name in features}
+        last_hidden_state = self.session.run(None, feeds)[0]
+
+        # Mean-pool the token embeddings, ignoring padding
+        mask = features["attention_mask"].astype(np.float32)
+        pooled = np.einsum("bsh,bs->bh", last_hidden_state, mask) / np.clip(mask.sum(axis=1, keepdims=True), 1e-9, None)
+        if self.normalize:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+
+# Raised when the embedding server cannot be reached or returns an error
+class EmbeddingServerError(RuntimeError):
+    pass
+
+
+# Sentence encoder that calls a running embedding_server.py over HTTP
+class HttpEncoder:
+    def __init__(self, base_url, timeout=30.0):
+        import httpx
+
+        # One client keeps the connection alive across queries
+        self.client = httpx.Client(base_url=base_url, timeout=timeout)
+        self._http_error = httpx.HTTPError
+
+    # Encode one sentence or a list of sentences; mirrors SentenceTransformer.encode
+    def encode(self, sentences, **kwargs):
+        if not isinstance(sentences, str):
+            return np.asarray(self._post("/encode_batch", {"texts": list(sentences)})["embeddings"], dtype=np.float32)
+        return np.asarray(self._post("/encode", {"text": sentences})["embedding"], dtype=np.float32)
+
+    def _post(self, path, payload):
+        try:
+            response = self.client.post(path, json=payload)
+            response.raise_for_status()
+        except self._http_error as e:
+            raise EmbeddingServerError(f"Embedding server request to {path} failed: {e}") from e
+        return response.json()
+
+
+# Function to configure PyTorch for CPU inference (every core for intra-op parallelism).
+# load_encoder() calls it before loading the PyTorch model, so torch is only imported
+# when that model is actually used.
+def configure_torch_threads():
+    import torch
+
+    torch.set_num_threads(os.cpu_count() or 1)
+    torch.set_num_interop_threads(2)
+    torch.backends.mkldnn.enabled = True
+
+
+# Function to export and optimize a model, then INT8-quantize it or convert it
+# to FP16 (only runs once per cache dir)
+def export_onnx_model(model_name, save_dir, precision):
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+    from transformers import AutoTokenizer
+
+    hub_id = hub_model_id(model_name)
+    print(f"Exporting {hub_id} to ONNX ({precision}, one-time step)...")
+
+    exported = ORTModelForFeatureExtraction.from_pretrained(hub_id, export=True)
+    optimizer = ORTOptimizer.from_pretrained(exported)
+    optimizer.optimize(save_dir=save_dir, optimization_config=OptimizationConfig(optimization_level=2))
+
+    if precision == "fp16":
+        from onnxruntime.transformers.optimizer import optimize_model
+
+        # Keep float32 inputs/outputs so the pooling code is unchanged
+        fp16_model = optimize_model(os.path.join(save_dir, "model_optimized.onnx"), model_type="bert",
+                                    opt_level=99, use_gpu=False)
+        fp16_model.convert_float_to_float16(keep_io_types=True)
+        fp16_model.save_model_to_file(os.path.join(save_dir, ONNX_MODEL_FILES["fp16"]))
+    else:
+        quantizer = ORTQuantizer.from_pretrained(save_dir, file_name="model_optimized.onnx")
+        quantizer.quantize(
+            save_dir=save_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False),
+        )
+    AutoTokenizer.from_pretrained(hub_id).save_pretrained(save_dir)
+
+
+# Function to load the embedding model, preferring the ONNX version on CPU.
+# Otherwise the PyTorch model is used (converted to fp16 on a GPU).
+def load_encoder(model_name, device=None):
+    if USE_ONNX and device in (None, "cpu"):
+        try:
+            file_name = ONNX_MODEL_FILES[ONNX_PRECISION]
+            model_dir = os.path.join(ONNX_CACHE_DIR, f"{model_name.replace('/', '__')}-{ONNX_PRECISION}")
+            if not os.path.exists(os.path.join(model_dir, file_name)):
+                export_onnx_model(model_name, model_dir, ONNX_PRECISION)
+            return OnnxEncoder(model_dir, file_name)
+        except ImportError as e:
+            print(f"ONNX Runtime not available ({e}), using the PyTorch model instead")
+
+    configure_torch_threads()
+    return TransformerEncoder(model_name, device=device)
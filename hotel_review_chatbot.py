@@ -1,12 +1,23 @@
 # Import required libraries
-from sentence_transformers import SentenceTransformer
+from encoders import EMBEDDING_MODEL, EmbeddingServerError, HttpEncoder, load_encoder
+from serializers import json_serializer, json_transcoder
+from sim import top_k_cosine
 from couchbase.cluster import Cluster
 from couchbase.options import ClusterOptions
 from couchbase.auth import PasswordAuthenticator
 from couchbase.exceptions import CouchbaseException
 import couchbase.search as search
-from couchbase.options import SearchOptions, ClusterTimeoutOptions
-from couchbase.vector_search import VectorQuery, VectorSearch
+from couchbase.options import SearchOptions, ClusterTimeoutOptions, QueryOptions
+try:
+    from couchbase.vector_search import VectorQuery, VectorSearch
+except ImportError:
+    VectorQuery = VectorSearch = None
+import numpy as np
+import atexit
+import base64
+import functools
+import logging
+import threading
 import os
 import sys
 from datetime import timedelta
@@ -15,8 +26,16 @@ from datetime import timedelta
 import couchbase
 print(f"Couchbase Python SDK Version: {couchbase.__version__}")
 
-# Load the sentence transformer model - use the same model as the embedding creation
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# URL of a running embedding_server.py; when set, the model is not loaded in this process
+EMBEDDING_SERVER_URL = os.getenv("EMBEDDING_SERVER_URL")
+
+if EMBEDDING_SERVER_URL:
+    model = HttpEncoder(EMBEDDING_SERVER_URL)
+else:
+    # Load the sentence transformer model - use the same model as the embedding creation
+    model = load_encoder(EMBEDDING_MODEL)
+    # Questions are short; cap the sequence length so a long paste doesn't blow up attention cost
+    model.max_seq_length = int(os.getenv("MAX_SEQ_LENGTH", "128"))
 
 # Couchbase Capella connection parameters
 # Update these with your actual Capella connection details
@@ -29,6 +48,40 @@ CB_COLLECTION_TARGET = "reviewvector"
 # Vector search index name - just use the base name without bucket/scope prefix
 VECTOR_INDEX_NAME = "rv_idx"  # Changed from "travel-sample.inventory.rv_idx"
 
+# Detect once which vector search API this SDK version offers: SearchRequest with
+# VectorSearch (modern), a bare search.VectorQuery (legacy), or neither (N1QL only)
+if VectorSearch is not None and hasattr(search, 'SearchRequest') and hasattr(search.SearchRequest, 'create'):
+    _SEARCH_IMPL = 'modern'
+elif hasattr(search, 'VectorQuery'):
+    _SEARCH_IMPL = 'legacy'
+else:
+    _SEARCH_IMPL = 'n1ql'
+
+# SDK 4.2.1+ accepts the query vector as base64-encoded float32, which skips building
+# a list of 384 Python floats for every search; older SDKs need a list
+try:
+    VectorQuery('embedding', base64.b64encode(np.zeros(1, dtype='<f4').tobytes()).decode('ascii'))
+    _VECTOR_QUERY_BASE64 = True
+except Exception:
+    _VECTOR_QUERY_BASE64 = False
+
+# Per-query and per-row diagnostics are logged at DEBUG level (run with LOG_LEVEL=DEBUG)
+logger = logging.getLogger(__name__)
+
+# Fields returned with each search hit. review_content is kept because every result
+# displays it; review_ratings (the largest field) is left out and fetched from KV
+# only when a result is expanded. Store these fields in the index so hits can be
+# displayed without a KV fetch.
+SEARCH_RESULT_FIELDS = ["hotel_name", "review_content", "review_author", "review_date"]
+
+# Storage format of the review embeddings; must match EMBEDDING_FORMAT used by embedder.py.
+# With base64 vectors the exact N1QL VECTOR_DISTANCE scan cannot be used.
+EMBEDDING_FORMAT = os.getenv("EMBEDDING_FORMAT", "float").lower()
+
+# Local copy of the review vectors written by embedder.py (embeddings.f32 + ids.txt),
+# searched directly when the vector search index cannot be used
+VECTOR_EXPORT_DIR = os.getenv("VECTOR_EXPORT_DIR", "vector_export")
+
 # Path to the Capella certificate file
 CERT_PATH = "/Users/sandhya.krishnamurthy/Downloads/AIchatbot/AIDEMOCLUSTER-root-certificate.pem"
 
@@ -38,6 +91,16 @@ if not os.path.exists(CERT_PATH):
     print("Download your certificate from Capella dashboard and update the CERT_PATH")
     sys.exit(1)
 
+# Cluster, scope and collection handles, opened once by get_cluster() and reused by every query
+_cluster = None
+_scope = None
+_collection = None
+_cluster_lock = threading.Lock()
+# (ids, embedding matrix) from VECTOR_EXPORT_DIR, memory-mapped on first use
+_local_vectors = None
+# Whether the vector search index is usable; checked once per session (None = not checked yet)
+_INDEX_OK = None
+
 # Function to connect to Couchbase Capella
 def connect_to_capella():
     print(f"Connecting to Couchbase Capella at {CB_HOSTNAME}...")
@@ -54,8 +117,12 @@ def connect_to_capella():
             query_timeout=timedelta(seconds=75)
         )
         
-        # Create cluster options with certificate path
-        options = ClusterOptions(auth, timeout_options=timeout_opts)
+        # Create cluster options with certificate path. The orjson-backed serializer
+        # (when installed) decodes query and search rows and the transcoder decodes KV
+        # documents. Query parameters are not affected: the SDK always encodes them with
+        # its own DefaultJsonSerializer.
+        options = ClusterOptions(auth, timeout_options=timeout_opts,
+                                 serializer=json_serializer(), transcoder=json_transcoder())
         
         # Set certificate path for TLS/SSL connections
         options.ssl_cert = CERT_PATH
@@ -76,6 +143,31 @@ def connect_to_capella():
         print("4. Check that your IP address is allowed in Capella's allowed IP list")
         sys.exit(1)
 
+# Function to get the shared cluster connection, connecting on first use
+def get_cluster():
+    global _cluster, _scope, _collection
+    if _cluster is None:
+        with _cluster_lock:
+            if _cluster is None:
+                cluster = connect_to_capella()
+                _scope = cluster.bucket(CB_BUCKET).scope(CB_SCOPE)
+                _collection = _scope.collection(CB_COLLECTION_TARGET)
+                _cluster = cluster
+                atexit.register(cluster.close)
+    return _cluster
+
+# Function to get the shared scope handle, connecting on first use
+def get_scope():
+    if _scope is None:
+        get_cluster()
+    return _scope
+
+# Function to get the shared target collection handle, connecting on first use
+def get_collection():
+    if _collection is None:
+        get_cluster()
+    return _collection
+
 # Function to display available search indexes (informational only)
 def list_search_indexes(cluster):
     try:
@@ -104,191 +196,368 @@ def list_search_indexes(cluster):
         import traceback
         traceback.print_exc()
 
-# Function to perform vector search
-def perform_vector_search(user_input, top_k=5):
+# Function to check whether the vector search index exists.
+# Returns True/False, or None if the index list could not be retrieved.
+def check_vector_search_index(cluster):
     try:
-        # Connect to Couchbase
-        cluster = connect_to_capella()
-        if cluster is None:
-            print("Error: Failed to connect to Couchbase")
-            return []
-            
-        bucket = cluster.bucket(CB_BUCKET)
-        scope = bucket.scope(CB_SCOPE)
-        collection = scope.collection(CB_COLLECTION_TARGET)
+        # Scoped indexes are listed by the scope's manager; fall back to the cluster's
+        try:
+            indexes = get_scope().search_indexes().get_all_indexes()
+        except Exception:
+            indexes = cluster.search_indexes().get_all_indexes()
+    except Exception as e:
+        print(f"Cannot check search indexes: {e}")
+        return None
+
+    for idx in indexes:
+        if idx.name == VECTOR_INDEX_NAME or idx.name.endswith(f".{VECTOR_INDEX_NAME}"):
+            return True
+    print(f"Warning: search index '{VECTOR_INDEX_NAME}' not found in bucket '{CB_BUCKET}', scope '{CB_SCOPE}'")
+    return False
+
+# Function to get the cached index status, checking it on first use. If the check
+# itself fails the index is assumed to exist so the Search API is still tried.
+def vector_index_available(cluster):
+    global _INDEX_OK
+    if _INDEX_OK is None:
+        _INDEX_OK = check_vector_search_index(cluster) is not False
+    return _INDEX_OK
+
+# Function to forget the cached index status and local vector export (the /refresh command)
+def refresh_index_status():
+    global _INDEX_OK, _local_vectors
+    _INDEX_OK = None
+    _local_vectors = None
+
+# Function to search without the Search API: N1QL first, then the local vector export
+def search_without_index(cluster, query_embedding, top_k=5):
+    try:
+        return fallback_to_n1ql(cluster, query_embedding, top_k)
+    except Exception as n1ql_ex:
+        print(f"N1QL vector search failed: {n1ql_ex}")
+        return local_vector_search(query_embedding, top_k)
+
+# Function to turn (document id, document fields, distance) triples into display results,
+# yielded one at a time. All the distances are converted to similarity strings in one
+# vectorized step. Ratings are not part of a result; 'expand N' fetches them on demand.
+def build_results(scored_raw):
+    if not scored_raw:
+        return
+    distances = np.fromiter((distance for _, _, distance in scored_raw), dtype=np.float32, count=len(scored_raw))
+    similarity_strs = np.char.mod("%.2f", 1.0 - distances)
+    for (doc_id, doc_content, _), similarity in zip(scored_raw, similarity_strs):
+        yield {
+            "doc_id": doc_id,
+            "hotel_name": doc_content.get("hotel_name", "Unknown Hotel"),
+            "review_content": doc_content.get("review_content", "No content available"),
+            "review_author": doc_content.get("review_author", "Anonymous"),
+            "review_date": doc_content.get("review_date", "Unknown date"),
+            "similarity_score": str(similarity)
+        }
+
+# Whether questions can be lowercased before encoding. Only uncased models (such as
+# all-MiniLM-L6-v2, whose tokenizer lowercases anyway) give the same vector either way;
+# with a cased model, or a remote model whose tokenizer isn't visible here, case is kept.
+_LOWERCASE_QUERIES = bool(getattr(getattr(model, "tokenizer", None), "do_lower_case", False))
+
+# Function to normalize a question into the text that is encoded and cached
+def normalize_query(user_input):
+    text = user_input.strip()
+    return text.lower() if _LOWERCASE_QUERIES else text
+
+# Function to embed a question, caching repeats. Callers pass normalize_query(text);
+# semantic normalization beyond that is out of scope.
+# The cached vector is a contiguous float32 array, marked read-only because it is shared.
+@functools.lru_cache(maxsize=1024)
+def _encode_cached(text):
+    embedding = np.ascontiguousarray(model.encode(text), dtype=np.float32)
+    embedding.setflags(write=False)
+    return embedding
+
+# Function to convert a query embedding into the form VectorQuery accepts
+def vector_query_value(query_embedding):
+    if _VECTOR_QUERY_BASE64:
+        return base64.b64encode(query_embedding.astype('<f4').tobytes()).decode('ascii')
+    return query_embedding.tolist()
+
+# Function to memory-map the exported review vectors of the given dimension
+# (returns None if there is no export, or if it does not match the ids)
+def load_local_vectors(dim):
+    global _local_vectors
+    if _local_vectors is None:
+        ids_path = os.path.join(VECTOR_EXPORT_DIR, "ids.txt")
+        vectors_path = os.path.join(VECTOR_EXPORT_DIR, "embeddings.f32")
+        if not (os.path.exists(ids_path) and os.path.exists(vectors_path)):
+            return None
+        with open(ids_path) as f:
+            ids = f.read().split()
+        if not ids:
+            return None
+        # An interrupted ingestion run can leave the two files out of step
+        expected_size = len(ids) * dim * 4
+        actual_size = os.path.getsize(vectors_path)
+        if actual_size != expected_size:
+            print(f"Local vector export is inconsistent: {vectors_path} has {actual_size} bytes, "
+                  f"expected {expected_size} for {len(ids)} ids of dimension {dim}")
+            return None
+        matrix = np.memmap(vectors_path, dtype='<f4', mode='r', shape=(len(ids), dim))
+        _local_vectors = (ids, matrix)
+    return _local_vectors
+
+# Function to search the exported review vectors locally and fetch the matching documents
+def local_vector_search(query_embedding, top_k=5):
+    local_vectors = load_local_vectors(query_embedding.shape[0])
+    if local_vectors is None:
+        print(f"No usable local vector export found in '{VECTOR_EXPORT_DIR}'")
+        return iter(())
+
+    print("Searching the local vector export...")
+    ids, matrix = local_vectors
+    # The exported rows are already L2-normalized, so the memory map is scored in place
+    indices, scores = top_k_cosine(query_embedding, matrix, top_k, normalized=True)
+    doc_ids = [ids[i] for i in indices]
+    if not doc_ids:
+        return iter(())
+
+    scored_raw = []
+    multi_result = get_collection().get_multi(doc_ids)
+    for doc_id, distance in zip(doc_ids, 1.0 - scores):
+        if doc_id in multi_result.exceptions:
+            print(f"Error fetching document {doc_id}: {multi_result.exceptions[doc_id]}")
+            continue
+        scored_raw.append((doc_id, multi_result.results[doc_id].content_as[dict], distance))
+    return build_results(scored_raw)
+
+# Function to run the vector search through N1QL when the Search API is unavailable.
+# SEARCH() with a knn clause walks the vector index; the exact VECTOR_DISTANCE scan
+# over every document is only used if SEARCH() itself fails.
+def fallback_to_n1ql(cluster, query_embedding, top_k=5):
+    # Query parameters are JSON, so this is where the vector becomes a list
+    query_vector = query_embedding.tolist()
+    keyspace = f"`{CB_BUCKET}`.`{CB_SCOPE}`.`{CB_COLLECTION_TARGET}`"
+    fields = "META(r).id AS doc_id, r.hotel_name, r.review_content, r.review_author, r.review_date"
+    search_request = {
+        "query": {"match_none": {}},
+        "knn": [{"field": "embedding", "vector": query_vector, "k": top_k}],
+        "size": top_k
+    }
+    search_query = f"""
+        SELECT {fields}, SEARCH_SCORE() AS score
+        FROM {keyspace} AS r
+        WHERE SEARCH(r, $search_request, {{"index": "{VECTOR_INDEX_NAME}"}})
+        ORDER BY score DESC
+        LIMIT $top_k
+    """
+    exact_query = f"""
+        SELECT {fields}, score
+        FROM {keyspace} AS r
+        LET score = VECTOR_DISTANCE(r.embedding, $query_vector, "COSINE")
+        WHERE score IS NOT NULL
+        ORDER BY score
+        LIMIT $top_k
+    """
+
+    try:
+        print("Attempting vector search using N1QL SEARCH()...")
+        rows = list(cluster.query(search_query, QueryOptions(
+            named_parameters={"search_request": search_request, "top_k": top_k}
+        )))
+    except Exception as e:
+        print(f"N1QL SEARCH() error: {e}")
+        # VECTOR_DISTANCE needs an array; base64-encoded vectors would all score NULL
+        if EMBEDDING_FORMAT == "base64":
+            raise
+        print("Falling back to exact VECTOR_DISTANCE scan...")
+        rows = list(cluster.query(exact_query, QueryOptions(
+            named_parameters={"query_vector": query_vector, "top_k": top_k}
+        )))
+
+    # A NULL score means the document could not be scored, so it is left out
+    return build_results([
+        (doc_content["doc_id"], doc_content, doc_content["score"])
+        for doc_content in rows if doc_content.get("score") is not None
+    ])
+
+# Function to run a pure vector search (no match-none full-text phase) with the SearchRequest API
+def _search_modern(scope, query_embedding, top_k, num_candidates):
+    search_req = search.SearchRequest.create(
+        VectorSearch.from_vector_query(VectorQuery('embedding', vector_query_value(query_embedding), num_candidates=num_candidates))
+    )
+    # Use just the index name without bucket.scope prefix
+    return scope.search(VECTOR_INDEX_NAME, search_req, SearchOptions(limit=top_k, fields=SEARCH_RESULT_FIELDS))
+
+# Function to run the vector search on SDKs that take a bare VectorQuery
+def _search_legacy(scope, query_embedding, top_k, num_candidates):
+    vector_query = search.VectorQuery('embedding', query_embedding.tolist())
+    return scope.search(VECTOR_INDEX_NAME, vector_query, SearchOptions(limit=top_k, fields=SEARCH_RESULT_FIELDS))
+
+# Search API handlers, selected by _SEARCH_IMPL
+_SEARCH_HANDLERS = {
+    'modern': _search_modern,
+    'legacy': _search_legacy,
+}
+
+# Function to perform vector search, yielding results in ranking order as they are built
+# num_candidates is the ANN search breadth (HNSW efSearch); by default it grows with top_k
+def perform_vector_search(user_input, top_k=5, num_candidates=None):
+    if num_candidates is None:
+        num_candidates = max(top_k * 10, 64)
+    try:
+        # Reuse the shared connection and handles
+        cluster = get_cluster()
+        scope, collection = get_scope(), get_collection()
         
         # Generate embedding for the user input
-        query_embedding = model.encode(user_input).tolist()
+        query_embedding = _encode_cached(normalize_query(user_input))
+        
+        # Skip the Search API entirely when this SDK lacks it or the index is known to be missing
+        if _SEARCH_IMPL == 'n1ql' or not vector_index_available(cluster):
+            yield from search_without_index(cluster, query_embedding, top_k)
+            return
         
         print("Attempting vector search using Search API...")
         
         try:
-            # Create a search request with vector search component
-            search_req = search.SearchRequest.create(search.MatchNoneQuery()).with_vector_search(
-                VectorSearch.from_vector_query(VectorQuery('embedding', query_embedding, num_candidates=100))
-            )
-            
-            # Execute the search directly on the scope
-            result = scope.search(
-                VECTOR_INDEX_NAME,  # Use just the index name without bucket.scope prefix
-                search_req,
-                SearchOptions(
-                    limit=top_k,
-                    fields=["hotel_name", "review_content", "review_author", "review_date", "review_ratings"]
-                )
-            )
+            result = _SEARCH_HANDLERS[_SEARCH_IMPL](scope, query_embedding, top_k, num_candidates)
         except Exception as e:
-            print(f"Search API error with SearchRequest: {e}")
-            print("Trying alternative direct vector search...")
-            
-            # Simplified alternative approach
-            vector_query = search.VectorQuery('embedding', query_embedding)
-            result = scope.search(
-                VECTOR_INDEX_NAME,
-                vector_query,
-                SearchOptions(
-                    limit=top_k,
-                    fields=["hotel_name", "review_content", "review_author", "review_date", "review_ratings"]
-                )
-            )
+            print(f"Search API error: {e}")
+            yield from search_without_index(cluster, query_embedding, top_k)
+            return
         
-        # Process the results
-        scored_results = []
+        # Process the results, collecting (document id, document fields, score) triples
+        scored_raw = []
         
-        # Print result info for debugging
-        print(f"Result type: {type(result)}")
-        if hasattr(result, '__dict__'):
-            print(f"Result __dict__: {result.__dict__}")
+        # Log result info for debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Result type: %s", type(result))
+            if hasattr(result, '__dict__'):
+                logger.debug("Result __dict__: %s", result.__dict__)
         
         # First try to use direct hits if available
         if hasattr(result, 'hits') and isinstance(result.hits, list):
-            print(f"Found {len(result.hits)} hits directly in result.hits")
+            logger.debug("Found %d hits directly in result.hits", len(result.hits))
             
             for hit in result.hits:
                 if isinstance(hit, dict) and 'fields' in hit:
-                    fields = hit['fields']
-                    score = hit.get('score', 0)
-                    
-                    result_item = {
-                        "hotel_name": fields.get("hotel_name", "Unknown Hotel"),
-                        "review_content": fields.get("review_content", "No content available"),
-                        "review_author": fields.get("review_author", "Anonymous"),
-                        "review_date": fields.get("review_date", "Unknown date"),
-                        "similarity_score": f"{1-score:.2f}",
-                        "ratings": fields.get("review_ratings", {})
-                    }
-                    scored_results.append(result_item)
+                    scored_raw.append((hit.get('id'), hit['fields'], hit.get('score', 0)))
             
-            if scored_results:
-                print(f"Successfully extracted {len(scored_results)} results from hits")
-                return scored_results
+            if scored_raw:
+                logger.debug("Successfully extracted %d results from hits", len(scored_raw))
+                yield from build_results(scored_raw)
+                return
         
-        # If no hits, use the regular rows method but fetch documents with KV
+        # If no hits, use the regular rows method
         try:
-            # Get rows from the result
-            rows = list(result.rows())
-            print(f"Successfully collected {len(rows)} rows")
+            # Walk the rows once, keeping each row's score and any stored fields returned with it
+            score_by_id = {}
+            docs_by_id = {}
+            for row in result.rows():
+                score_by_id[row.id] = row.score
+                if row.fields:
+                    docs_by_id[row.id] = row.fields
+            logger.debug("Successfully collected %d rows", len(score_by_id))
             
-            # Process each row by fetching the document
-            for row in rows:
-                print(f"Processing row ID: {row.id}")
-                
-                # Get the document ID from the row
-                doc_id = row.id
-                
-                # Fetch the actual document using the ID
+            # Fetch only the documents whose fields the index did not return, in one pipelined batch
+            doc_ids = list(score_by_id)
+            missing_ids = [doc_id for doc_id in doc_ids if doc_id not in docs_by_id]
+            multi_result = collection.get_multi(missing_ids) if missing_ids else None
+            
+            # Collect the fetched documents, remembering the keys that failed
+            failed_ids = []
+            for doc_id in missing_ids:
+                logger.debug("Processing row ID: %s", doc_id)
+                if doc_id in multi_result.exceptions:
+                    print(f"Error fetching document {doc_id}: {multi_result.exceptions[doc_id]}")
+                    failed_ids.append(doc_id)
+                    continue
+                docs_by_id[doc_id] = multi_result.results[doc_id].content_as[dict]
+            
+            # Retry all the failed keys with a single N1QL query
+            if failed_ids:
+                print("Trying an alternative approach...")
                 try:
-                    # Get document from collection
-                    doc_result = collection.get(doc_id)
-                    doc_content = doc_result.content_as[dict]
-                    
-                    # Create result item from the document content
-                    result_item = {
-                        "hotel_name": doc_content.get("hotel_name", "Unknown Hotel"),
-                        "review_content": doc_content.get("review_content", "No content available"),
-                        "review_author": doc_content.get("review_author", "Anonymous"),
-                        "review_date": doc_content.get("review_date", "Unknown date"),
-                        "similarity_score": f"{1-row.score:.2f}",
-                        "ratings": doc_content.get("review_ratings", {})
-                    }
-                    scored_results.append(result_item)
-                    print(f"Successfully processed document: {doc_id}")
-                    
-                except Exception as doc_ex:
-                    print(f"Error fetching document {doc_id}: {doc_ex}")
-                    print("Trying an alternative approach...")
-                    
-                    # If we can't get the document directly, try a N1QL query as fallback
-                    try:
-                        query = f'SELECT hotel_name, review_content, review_author, review_date, review_ratings FROM `{CB_BUCKET}`.`{CB_SCOPE}`.`{CB_COLLECTION_TARGET}` WHERE META().id = "{doc_id}"'
-                        query_result = cluster.query(query)
-                        
-                        # Check if we got results
-                        rows_list = list(query_result)
-                        if rows_list:
-                            doc_content = rows_list[0]
-                            
-                            result_item = {
-                                "hotel_name": doc_content.get("hotel_name", "Unknown Hotel"),
-                                "review_content": doc_content.get("review_content", "No content available"),
-                                "review_author": doc_content.get("review_author", "Anonymous"),
-                                "review_date": doc_content.get("review_date", "Unknown date"),
-                                "similarity_score": f"{1-row.score:.2f}",
-                                "ratings": doc_content.get("review_ratings", {})
-                            }
-                            scored_results.append(result_item)
-                            print(f"Successfully processed document using N1QL: {doc_id}")
-                    except Exception as query_ex:
-                        print(f"Error fetching document with N1QL: {query_ex}")
+                    # Parameterized so the prepared plan is reused across lookups
+                    query = f'SELECT META().id AS doc_id, hotel_name, review_content, review_author, review_date FROM `{CB_BUCKET}`.`{CB_SCOPE}`.`{CB_COLLECTION_TARGET}` WHERE META().id IN $1'
+                    query_result = cluster.query(query, QueryOptions(positional_parameters=[failed_ids], adhoc=False))
+                    for doc_content in query_result:
+                        docs_by_id[doc_content["doc_id"]] = doc_content
+                        logger.debug("Successfully processed document using N1QL: %s", doc_content['doc_id'])
+                except Exception as query_ex:
+                    print(f"Error fetching documents with N1QL: {query_ex}")
+            
+            # Keep the search ranking order
+            scored_raw = [(doc_id, docs_by_id[doc_id], score_by_id[doc_id]) for doc_id in doc_ids if doc_id in docs_by_id]
         
         except Exception as e:
             print(f"Error processing search results: {e}")
             import traceback
             traceback.print_exc()
+            if not scored_raw:
+                yield from local_vector_search(query_embedding, top_k)
+                return
         
         # Return the results
-        print(f"Returning {len(scored_results)} results")
-        return scored_results
+        logger.debug("Returning %d results", len(scored_raw))
+        yield from build_results(scored_raw)
     
     except CouchbaseException as ex:
         print(f"Error performing vector search: {ex}")
         import traceback
         traceback.print_exc()
-        return []
 
-# Function to display search results
+# Function to display search results. Accepts any iterable (including the generator
+# from perform_vector_search), prints each result as soon as it is available and
+# returns the displayed results so they can be expanded later.
 def display_results(results):
-    if not results:
-        print("No relevant reviews found.")
-        return
-    
-    print("\n" + "="*80)
-    print(f"Found {len(results)} relevant reviews:\n")
-    
+    shown = []
     for i, result in enumerate(results, 1):
+        if i == 1:
+            print("\n" + "="*80)
+            print("Relevant reviews:\n")
+        shown.append(result)
         print(f"Result {i} (Similarity: {result['similarity_score']})")
         print(f"Hotel: {result['hotel_name']}")
         print(f"Review: {result['review_content']}")
         print(f"Author: {result['review_author']} - Date: {result['review_date']}")
-        
-        # Add ratings if available
-        if result['ratings']:
-            print("Ratings:")
-            for category, rating in result['ratings'].items():
-                print(f"- {category}: {rating}")
-        
         print("-"*80)
+    
+    if shown:
+        print(f"Found {len(shown)} relevant reviews.")
+    else:
+        print("No relevant reviews found.")
+    return shown
+
+# Function to fetch and print the full review document behind a displayed result
+def expand_result(result):
+    try:
+        doc_content = get_collection().get(result["doc_id"]).content_as[dict]
+    except Exception as e:
+        print(f"Error fetching document {result['doc_id']}: {e}")
+        return
+    
+    print("\n" + "="*80)
+    print(f"Hotel: {doc_content.get('hotel_name', 'Unknown Hotel')}")
+    print(f"Review: {doc_content.get('review_content', 'No content available')}")
+    print(f"Author: {doc_content.get('review_author', 'Anonymous')} - Date: {doc_content.get('review_date', 'Unknown date')}")
+    ratings = doc_content.get("review_ratings", {})
+    if ratings:
+        print("Ratings:")
+        for category, rating in ratings.items():
+            print(f"- {category}: {rating}")
+    print("-"*80)
 
 # Main function to run the CLI chatbot
 def main():
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(), format="%(levelname)s %(message)s")
     try:
         # Print SDK version for debugging
         import couchbase
         print(f"Couchbase Python SDK Version: {couchbase.__version__}")
+        logger.debug("Vector search API: %s", _SEARCH_IMPL)
         
         # Test connection first
         print("Testing connection to Couchbase...")
-        cluster = connect_to_capella()
+        cluster = get_cluster()
         if cluster is None:
             print("Error: Failed to connect to Couchbase. cluster object is None.")
             return
@@ -297,11 +566,18 @@ def main():
         
         # Display available search indexes
         list_search_indexes(cluster)
+        vector_index_available(cluster)
         
         print("\nWelcome to the Hotel Review Chatbot!")
         print("Ask questions about hotel experiences, and I'll find the most relevant reviews!")
+        print("Type 'expand N' to see the full review and ratings for result N.")
+        print("Type '/refresh' after creating or changing the search index, or re-running embedder.py.")
         print("Type 'exit' or 'quit' to end the session.\n")
         
+        # Last question (normalized) and its results, for 'expand N' and repeated questions
+        last_query = None
+        last_results = []
+        
         while True:
             # Get user input
             user_input = input("\nYour question: ")
@@ -315,12 +591,40 @@ def main():
                 print("Please enter a question or topic about hotel experiences.")
                 continue
             
+            if user_input.strip().lower() == "/refresh":
+                refresh_index_status()
+                # The index may have changed, so a repeated question must search again
+                last_query = None
+                print("Search index available:", vector_index_available(cluster))
+                continue
+            
+            command = user_input.strip().lower().split()
+            if len(command) == 2 and command[0] == "expand" and command[1].isdigit():
+                index = int(command[1])
+                if 1 <= index <= len(last_results):
+                    expand_result(last_results[index - 1])
+                else:
+                    print(f"No result {index} to expand.")
+                continue
+            
+            # Show the previous results again when the same question is repeated
+            query_key = normalize_query(user_input)
+            if query_key == last_query:
+                display_results(last_results)
+                continue
+            
             # Perform vector search
             print("Searching for relevant reviews...")
             search_results = perform_vector_search(user_input)
             
-            # Display results
-            display_results(search_results)
+            # Display results, remembering them only if the search found something.
+            # An embedding server failure only fails this question, not the session.
+            try:
+                last_results = display_results(search_results)
+            except EmbeddingServerError as e:
+                print(f"Could not embed the question: {e}")
+                continue
+            last_query = query_key if last_results else None
             
     except KeyboardInterrupt:
         print("\nSession terminated by user. Goodbye!")
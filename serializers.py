@@ -0,0 +1,32 @@
+# orjson-backed JSON serialization for the Couchbase SDK
+#
+# orjson is several times faster than the standard json module on documents
+# dominated by long float lists (embeddings), and can serialize numpy arrays
+# directly. Falls back to the SDK defaults when orjson is not installed.
+from couchbase.serializer import DefaultJsonSerializer, Serializer
+from couchbase.transcoder import JSONTranscoder
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+# Serializer that uses orjson for both directions
+class OrjsonSerializer(Serializer):
+    def serialize(self, value):
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def deserialize(self, value):
+        return orjson.loads(value)
+
+
+# Function to get the fastest available JSON serializer
+def json_serializer():
+    return OrjsonSerializer() if ORJSON_AVAILABLE else DefaultJsonSerializer()
+
+
+# Function to get a JSON transcoder (used for KV documents) backed by json_serializer()
+def json_transcoder():
+    return JSONTranscoder(serializer=json_serializer())
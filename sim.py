@@ -0,0 +1,72 @@
+# Cosine similarity helpers for re-ranking candidate embeddings locally
+#
+# Uses SimSIMD's hand-tuned SIMD kernels when simsimd is installed, then a
+# parallel Numba kernel when numba is installed, otherwise plain numpy.
+import numpy as np
+
+try:
+    import simsimd
+    SIMSIMD_AVAILABLE = True
+except ImportError:
+    SIMSIMD_AVAILABLE = False
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+# Function to L2-normalize the rows of a matrix (done once, outside the kernel)
+def normalize_rows(matrix):
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+
+if NUMBA_AVAILABLE:
+    # Dot product of every row of A with every row of B, parallel over the rows of A
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dot_matrix(A, B):
+        out = np.empty((A.shape[0], B.shape[0]), dtype=np.float32)
+        for i in prange(A.shape[0]):
+            for j in range(B.shape[0]):
+                s = 0.0
+                for k in range(A.shape[1]):
+                    s += A[i, k] * B[j, k]
+                out[i, j] = s
+        return out
+else:
+    def _dot_matrix(A, B):
+        return A @ B.T
+
+
+# Function to compute the cosine similarity between every row of A and every row of B
+def cosine_sim_matrix(A, B):
+    if SIMSIMD_AVAILABLE:
+        # simsimd returns cosine distances and needs contiguous float32 buffers
+        A = np.ascontiguousarray(A, dtype=np.float32)
+        B = np.ascontiguousarray(B, dtype=np.float32)
+        return 1.0 - np.asarray(simsimd.cdist(A, B, metric="cosine"), dtype=np.float32)
+    return _dot_matrix(normalize_rows(A), normalize_rows(B))
+
+
+# Function to find the top_k rows of matrix most similar to a single query vector.
+# Returns (indices, scores) ordered from most to least similar. Pass normalized=True
+# when the rows are already unit length: the scores are then a single dot product
+# against the matrix, which is never copied (important for memory-mapped matrices).
+def top_k_cosine(query, matrix, top_k, normalized=False):
+    if normalized:
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = np.asarray(matrix @ query)
+    else:
+        scores = cosine_sim_matrix(np.asarray(query)[np.newaxis, :], matrix)[0]
+    top_k = min(top_k, scores.shape[0])
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    # Partial selection is O(N); only the k winners get fully sorted
+    indices = np.argpartition(-scores, top_k - 1)[:top_k]
+    indices = indices[np.argsort(-scores[indices])]
+    return indices, scores[indices]